@@ -1,13 +1,14 @@
 import os
 import csv
-import json
-from datetime import datetime
+from functools import lru_cache
 
 import numpy as np
 import pandas as pd
 import yfinance as yf
 import pandas_market_calendars as mcal
 
+from json_io import dumps as _dumps, loads as _loads, write_atomic as _write_atomic, rewrite_nav_tail
+
 # ============================================================
 # 1. CONFIGURATION
 # ============================================================
@@ -20,22 +21,53 @@ OUTPUT_PATH = "public/data/eom_signal.json"       # JSON for frontend
 STATE_PATH = "public/data/fund2_state.json"       # Persistent NAV + positions
 TRADELOG_PATH = "public/data/fund2_tradelog.csv"  # Trade log
 NAV_PATH = "public/data/fund2_nav.json"           # NAV time series (NEW)
+CACHE_PATH = ".cache/eom_prices.parquet"          # Price cache (not committed)
 
 INITIAL_NAV = 50_000.0
 FEE_PER_TRADE = 29.0      # BUY = 29, SELL = 29 NOK
 
 
+# Column dtypes for the tradelog; blank cells read as NA
+TRADELOG_DTYPES = {
+    "Ticker": "string", "EntryDate": "string", "EntryPrice": "float64",
+    "ExitDate": "string", "ExitPrice": "float64",
+    "Qty": "float64", "StakeNOK": "float64", "FeesNOK": "float64",
+    "PL_NOK": "float64", "PL_PCT": "float64", "Reason": "string"
+}
+
+# Numeric state fields; orjson stores NaN in them as null
+STATE_FLOAT_KEYS = ("initial_nav", "nav")
+POSITION_FLOAT_KEYS = ("qty", "entry_price", "stake_nok")
+
+
 # ============================================================
 # 2. FILE HELPERS: STATE + NAV + TRADELOG
 # ============================================================
 
+def _ymd(ts):
+    """YYYY-MM-DD string for a Timestamp, sliced from isoformat()."""
+    return ts.isoformat()[:10]
+
+
+_dirs_ok = False
+
+
 def ensure_dirs():
+    global _dirs_ok
+    if _dirs_ok:
+        return
     dirname = os.path.dirname(OUTPUT_PATH)
-    if dirname and not os.path.isdir(dirname):
+    if dirname:
         os.makedirs(dirname, exist_ok=True)
+    _dirs_ok = True
+
+
+# Bytes of STATE_PATH as last read or written, to skip no-op saves
+_last_state_blob = None
 
 
 def load_state():
+    global _last_state_blob
     ensure_dirs()
     if not os.path.isfile(STATE_PATH):
         state = {
@@ -48,36 +80,58 @@ def load_state():
         save_state(state)
         return state
 
-    with open(STATE_PATH, "r", encoding="utf-8") as f:
-        return json.load(f)
+    with open(STATE_PATH, "rb") as f:
+        _last_state_blob = f.read()
+    state = _loads(_last_state_blob)
+
+    # orjson writes NaN as null; read those numbers back as NaN
+    _none_to_nan(state, STATE_FLOAT_KEYS)
+    for pos in state.get("open_positions", {}).values():
+        _none_to_nan(pos, POSITION_FLOAT_KEYS)
+    return state
+
+
+def _none_to_nan(d, keys):
+    for k in keys:
+        if k in d and d[k] is None:
+            d[k] = float("nan")
 
 
 def save_state(state):
+    global _last_state_blob
+    blob = _dumps(state)
+    if blob == _last_state_blob:
+        return
     ensure_dirs()
-    with open(STATE_PATH, "w", encoding="utf-8") as f:
-        json.dump(state, f, indent=4)
+    _write_atomic(STATE_PATH, blob)
+    _last_state_blob = blob
 
 
 def load_nav_history():
     if not os.path.isfile(NAV_PATH):
         return []
-    with open(NAV_PATH, "r", encoding="utf-8") as f:
-        return json.load(f)
+    with open(NAV_PATH, "rb") as f:
+        return _loads(f.read())
 
 
 def save_nav_history(history):
-    with open(NAV_PATH, "w", encoding="utf-8") as f:
-        json.dump(history, f, indent=4)
+    _write_atomic(NAV_PATH, _dumps(history))
 
 
 def record_nav(date_str, nav_value):
-    """Append or update NAV history."""
-    history = load_nav_history()
+    """Append or update NAV history.
 
-    if history and history[-1]["date"] == date_str:
-        history[-1]["nav"] = nav_value
-    else:
-        history.append({"date": date_str, "nav": nav_value})
+    Only the last record of the JSON array is re-serialized, so a daily
+    update does not re-encode the whole history.
+    """
+    record = {"date": date_str, "nav": nav_value}
+    if os.path.isfile(NAV_PATH) and rewrite_nav_tail(NAV_PATH, record):
+        return
+
+    # Full rewrite, kept in date order
+    history = [h for h in load_nav_history() if h["date"] != date_str]
+    history.append(record)
+    history.sort(key=lambda h: h["date"])
 
     save_nav_history(history)
 
@@ -95,53 +149,60 @@ def ensure_tradelog_exists():
             ])
 
 
-def append_entry_trade(ticker, entry_date, entry_price, qty, stake_nok):
-    """Store BUY trade — charge 29 NOK per BUY."""
+def append_entry_trades(trades):
+    """Store BUY trades in one append — charge 29 NOK per BUY.
+
+    trades: iterable of (ticker, entry_date, entry_price, qty, stake_nok).
+    """
     with open(TRADELOG_PATH, "a", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
-        writer.writerow([
-            ticker,
-            entry_date,
-            float(entry_price),
-            "", "",
-            float(qty),
-            float(stake_nok),
-            float(FEE_PER_TRADE),  # BUY fee
-            "", "",
-            "BUY"
-        ])
-
-
-def close_open_trades(exit_date_str, exit_prices):
+        writer.writerows(
+            [
+                ticker,
+                entry_date,
+                float(entry_price),
+                "", "",
+                float(qty),
+                float(stake_nok),
+                float(FEE_PER_TRADE),  # BUY fee
+                "", "",
+                "BUY"
+            ]
+            for ticker, entry_date, entry_price, qty, stake_nok in trades
+        )
+
+
+def close_open_trades(exit_date_str, exit_prices, positions):
+    """Close the tradelog rows of the live positions.
+
+    A row is matched on (Ticker, EntryDate) against positions, so stale
+    rows that were never closed are left alone.
+    """
     if not os.path.isfile(TRADELOG_PATH):
         return
 
-    df = pd.read_csv(TRADELOG_PATH)
+    df = pd.read_csv(TRADELOG_PATH, engine="pyarrow", dtype=TRADELOG_DTYPES)
 
-    for idx, row in df[df["ExitDate"] == ""].iterrows():
-        ticker = row["Ticker"]
-        if ticker not in exit_prices:
-            continue
-
-        exit_price = float(exit_prices[ticker])
-        entry_price = float(row["EntryPrice"])
-        qty = float(row["Qty"])
-        stake = float(row["StakeNOK"])
+    # Open rows have a blank ExitDate (read back as NA)
+    entry_dates = df["Ticker"].map({t: pos["entry_date"] for t, pos in positions.items()})
+    open_rows = df["ExitDate"].isna() & df["EntryDate"].eq(entry_dates).fillna(False)
+    exit_px = df.loc[open_rows, "Ticker"].map(exit_prices).dropna()
+    if exit_px.empty:
+        return
 
-        buy_fee = float(row["FeesNOK"])   # stored earlier
-        sell_fee = FEE_PER_TRADE          # new fee
-        total_fees = buy_fee + sell_fee
+    rows = exit_px.index
+    stake = df.loc[rows, "StakeNOK"]
 
-        # Profit = qty * exit - stake - sell_fee
-        pl_nok = qty * exit_price - stake - sell_fee
-        pl_pct = pl_nok / stake if stake > 0 else 0
+    # Profit = qty * exit - stake - sell_fee
+    pl_nok = df.loc[rows, "Qty"] * exit_px - stake - FEE_PER_TRADE
+    pl_pct = (pl_nok / stake).where(stake > 0, 0.0)
 
-        df.loc[idx, "ExitDate"] = exit_date_str
-        df.loc[idx, "ExitPrice"] = exit_price
-        df.loc[idx, "FeesNOK"] = total_fees
-        df.loc[idx, "PL_NOK"] = pl_nok
-        df.loc[idx, "PL_PCT"] = pl_pct
-        df.loc[idx, "Reason"] = "SELL"
+    df.loc[rows, "ExitDate"] = exit_date_str
+    df.loc[rows, "ExitPrice"] = exit_px
+    df.loc[rows, "FeesNOK"] += FEE_PER_TRADE
+    df.loc[rows, "PL_NOK"] = pl_nok
+    df.loc[rows, "PL_PCT"] = pl_pct
+    df.loc[rows, "Reason"] = "SELL"
 
     df.to_csv(TRADELOG_PATH, index=False)
 
@@ -151,28 +212,70 @@ def close_open_trades(exit_date_str, exit_prices):
 # ============================================================
 
 def fetch_data():
-    data = yf.download(TOP6, start=START_DATE, auto_adjust=True)["Close"]
-    data = data.loc[:, ~data.columns.duplicated()]
-    return data
+    """Load cached closes and download only the bars since the last cached date."""
+    cached = None
+    start = START_DATE
+    if os.path.isfile(CACHE_PATH):
+        cached = pd.read_parquet(CACHE_PATH)
+        if cached.empty or not set(TOP6).issubset(cached.columns):
+            # Ticker list changed: rebuild the cache from scratch
+            cached = None
+        else:
+            # Re-fetch the last cached bar as well: intraday runs cache a partial bar.
+            start = _ymd(cached.index[-1])
+
+    data = yf.download(
+        TOP6, start=start, auto_adjust=True, threads=True, progress=False
+    )["Close"]
+    if cached is not None:
+        data = pd.concat([cached, data])
+        data = data[~data.index.duplicated(keep="last")]
+
+    # Fixed column order, no stray or dropped-ticker columns; yfinance
+    # already dedups the requested tickers
+    data = data.reindex(columns=TOP6)
+
+    os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+    # Stored as float32 to halve the file. The last bar, the only one priced
+    # from, is re-downloaded each run, so main() always sees full float64.
+    data.astype(np.float32).to_parquet(CACHE_PATH, compression="zstd")
+    return data.astype(np.float64)
 
 
 # ============================================================
 # 4. SIGNAL = LAST TRADING DAY OF THE MONTH
 # ============================================================
 
-def compute_signal_dates(data):
-    oslo = mcal.get_calendar("XOSL")
-    signal_dates = []
+@lru_cache(maxsize=4)
+def _cal(name):
+    """Exchange calendar, built once per process."""
+    return mcal.get_calendar(name)
+
+
+@lru_cache(maxsize=256)
+def _sessions(start_iso, end_iso):
+    """XOSL session dates between two YYYY-MM-DD strings, inclusive."""
+    return _cal("XOSL").schedule(start_date=start_iso, end_date=end_iso).index
+
+
+def month_signal_date(today):
+    """Last XOSL session of today's month, from the calendar alone (no prices)."""
+    month_start = today.replace(day=1)
+    month_days = _sessions(
+        _ymd(month_start), _ymd(month_start + pd.offsets.MonthEnd(1))
+    )
+    return month_days[-1] if len(month_days) > 0 else None
 
-    for year, month in sorted(set((d.year, d.month) for d in data.index)):
-        start = pd.Timestamp(year=year, month=month, day=1)
-        end = start + pd.offsets.MonthEnd(1)
-        schedule = oslo.schedule(start_date=start, end_date=end)
-        trading_days = schedule.index
-        if len(trading_days) > 0:
-            signal_dates.append(trading_days[-1])
 
-    return pd.DatetimeIndex(signal_dates)
+def mark_to_market(positions, last_row, col):
+    """Value positions at last_row prices.
+
+    Returns (tickers, prices, value); col maps ticker -> index in last_row.
+    """
+    tickers = list(positions)
+    qtys = np.fromiter((positions[t]["qty"] for t in tickers), dtype=np.float64, count=len(tickers))
+    pxs = last_row[[col[t] for t in tickers]]
+    return tickers, pxs, float(np.vdot(qtys, pxs))
 
 
 # ============================================================
@@ -181,62 +284,66 @@ def compute_signal_dates(data):
 
 def save_json(obj, filename):
     ensure_dirs()
-    with open(filename, "w", encoding="utf-8") as f:
-        json.dump(obj, f, indent=4)
+    _write_atomic(filename, _dumps(obj))
 
 
 # ============================================================
 # 6. MAIN LOGIC
 # ============================================================
 
-def main():
+def main(today=None):
+    """Run one update. today (a naive date Timestamp) defaults to the Oslo date."""
     ensure_dirs()
     ensure_tradelog_exists()
 
-    data = fetch_data()
     state = load_state()
-    signal_dates = compute_signal_dates(data)
-
-    today = pd.Timestamp.today().normalize()
-    today_str = today.strftime("%Y-%m-%d")
 
-    last_data_date = data.index[-1]
-    last_data_date_str = last_data_date.strftime("%Y-%m-%d")
-    latest_prices = data.loc[last_data_date].to_dict()
+    if today is None:
+        # Exchange-local date: late UTC runs already belong to the next Oslo day
+        today = pd.Timestamp.now(tz="Europe/Oslo").normalize().tz_localize(None)
+    else:
+        today = pd.Timestamp(today).normalize()
+    today_str = _ymd(today)
 
-    # Detect signal day
-    this_month_signal = [
-        d for d in signal_dates if d.year == today.year and d.month == today.month
-    ]
-    signal_date = this_month_signal[0] if this_month_signal else None
-    signal_date_str = signal_date.strftime("%Y-%m-%d") if signal_date else None
+    signal_date = month_signal_date(today)
+    signal_date_str = _ymd(signal_date) if signal_date else None
     is_signal_day = signal_date is not None and today == signal_date.normalize()
 
     has_open_positions = bool(state["open_positions"])
     planned_exit_date = state.get("planned_exit_date")
     is_exit_day = (planned_exit_date == today_str) and has_open_positions
 
+    # Nothing can trade or move NAV today: skip the download and reuse the
+    # prices stored by the last full run.
+    if not has_open_positions and not is_signal_day and "latest_prices" in state:
+        last_data_date_str = state["last_data_date"]
+        latest_prices = state["latest_prices"]
+        # Missing prices are stored as null; np.array maps them back to NaN
+        last_row = np.array(list(latest_prices.values()), dtype=np.float64)
+    else:
+        data = fetch_data()
+        last_data_date = data.index[-1]
+        last_data_date_str = _ymd(last_data_date)
+        last_row = data.iloc[-1].to_numpy(dtype=np.float64)
+        latest_prices = dict(zip(data.columns.tolist(), last_row.tolist()))
+        state["last_data_date"] = last_data_date_str
+        state["latest_prices"] = latest_prices
+
+    # Latest prices as one array plus a ticker -> column map
+    col = {t: i for i, t in enumerate(latest_prices)}
+
     # ============================================================
     # EXIT LOGIC
     # ============================================================
     exit_prices_dict = None
 
     if is_exit_day:
-        exit_prices_dict = {}
-        nav_new = 0.0
-        total_sell_fees = 0.0
-
-        for t, pos in state["open_positions"].items():
-            px = latest_prices[t]
-            qty = pos["qty"]
-
-            exit_prices_dict[t] = px
-            nav_new += qty * px
-            total_sell_fees += FEE_PER_TRADE
+        tickers, pxs, nav_new = mark_to_market(state["open_positions"], last_row, col)
 
-        nav_new -= total_sell_fees  # Subtract SELL costs
+        exit_prices_dict = dict(zip(tickers, pxs.tolist()))
+        nav_new -= len(tickers) * FEE_PER_TRADE  # Subtract SELL costs
 
-        close_open_trades(today_str, exit_prices_dict)
+        close_open_trades(today_str, exit_prices_dict, state["open_positions"])
 
         state["nav"] = float(nav_new)
         state["open_positions"] = {}
@@ -247,55 +354,51 @@ def main():
     # ============================================================
 
     if is_signal_day and not has_open_positions:
-        oslo = mcal.get_calendar("XOSL")
-        schedule = oslo.schedule(start_date=today, end_date=today + pd.Timedelta(days=30))
-        trading_days = schedule.index
-
-        exit_date = trading_days[7] if len(trading_days) > 7 else trading_days[-1]
-        exit_date_str = exit_date.strftime("%Y-%m-%d")
-
-        # Deduct BUY fees
-        nav_current = state["nav"]
-        total_buy_fees = len(TOP6) * FEE_PER_TRADE
-        nav_after_fees = nav_current - total_buy_fees
-        state["nav"] = nav_after_fees
-
-        stake_per = nav_after_fees / len(TOP6)
-
-        entry_prices = data.loc[last_data_date].to_dict()
-        open_positions = {}
-
-        for t in TOP6:
-            px = entry_prices[t]
-            qty = stake_per / px
-
-            open_positions[t] = {
-                "qty": qty,
-                "entry_price": px,
-                "entry_date": last_data_date_str,
-                "stake_nok": stake_per
+        # Exit on the 8th session counting today
+        trading_days = _cal("XOSL").valid_days(
+            today, today + pd.Timedelta(days=45)
+        ).tz_localize(None)
+        pos = trading_days.searchsorted(today)
+        exit_date = trading_days[min(pos + 7, len(trading_days) - 1)]
+        exit_date_str = _ymd(exit_date)
+
+        # Only tickers with a usable price are bought
+        prices = last_row[[col[t] for t in TOP6]]
+        valid = np.isfinite(prices) & (prices > 0)
+        n_buy = int(valid.sum())
+
+        if n_buy:
+            # Deduct BUY fees
+            nav_after_fees = state["nav"] - n_buy * FEE_PER_TRADE
+            state["nav"] = nav_after_fees
+
+            stake_per = nav_after_fees / n_buy
+            tickers = [t for t, ok in zip(TOP6, valid) if ok]
+            pxs = prices[valid].tolist()
+            qtys = (stake_per / prices[valid]).tolist()
+
+            state["open_positions"] = {
+                t: {
+                    "qty": qty,
+                    "entry_price": px,
+                    "entry_date": last_data_date_str,
+                    "stake_nok": stake_per
+                }
+                for t, px, qty in zip(tickers, pxs, qtys)
             }
+            state["planned_exit_date"] = exit_date_str
 
-            append_entry_trade(
-                t,
-                last_data_date_str,
-                px,
-                qty,
-                stake_per
+            append_entry_trades(
+                (t, last_data_date_str, px, qty, stake_per)
+                for t, px, qty in zip(tickers, pxs, qtys)
             )
 
-        state["open_positions"] = open_positions
-        state["planned_exit_date"] = exit_date_str
-
     # ============================================================
     # DAILY NAV UPDATE
     # ============================================================
 
     if state["open_positions"]:
-        nav_live = sum(
-            pos["qty"] * latest_prices[t] for t, pos in state["open_positions"].items()
-        )
-        state["nav"] = float(nav_live)
+        state["nav"] = mark_to_market(state["open_positions"], last_row, col)[2]
 
     # Save state and NAV series
     save_state(state)
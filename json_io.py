@@ -0,0 +1,87 @@
+# json_io.py
+# JSON file helpers shared by eom_strategy.py and portfolio_builder.py:
+# orjson with a stdlib fallback, atomic writes and the NAV-history tail patch.
+
+from __future__ import annotations
+import os
+import json
+
+try:
+    import orjson  # fast JSON; stdlib json is the fallback
+except ImportError:
+    orjson = None
+
+
+def dumps(obj, indent: bool = True) -> bytes:
+    """JSON bytes; NumPy scalars/arrays are accepted. indent=False gives compact output."""
+    if orjson is None:
+        if indent:
+            return json.dumps(obj, indent=2).encode("utf-8")
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+    return orjson.dumps(
+        obj,
+        option=(orjson.OPT_INDENT_2 if indent else 0) | orjson.OPT_SERIALIZE_NUMPY,
+    )
+
+
+def loads(raw: bytes):
+    """Parse JSON bytes; older files may contain NaN, which orjson rejects."""
+    if orjson is None:
+        return json.loads(raw)
+    try:
+        return orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        return json.loads(raw)
+
+
+def write_atomic(path: str, blob: bytes) -> None:
+    """Write via a temp file and os.replace, so readers never see a torn file."""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(blob)
+    os.replace(tmp, path)
+
+
+def write_if_changed(path: str, blob: bytes) -> None:
+    """write_atomic, skipped when the file already holds exactly blob."""
+    try:
+        with open(path, "rb") as f:
+            if f.read() == blob:
+                return
+    except FileNotFoundError:
+        pass
+    write_atomic(path, blob)
+
+
+def rewrite_nav_tail(path: str, record: dict) -> bool:
+    """Replace or append the last record of a JSON array of dated records.
+
+    Only the tail bytes are patched (the history is never re-serialized) and
+    the result is written with write_atomic. Returns False (caller does a full
+    rewrite) if the file does not end in a flat record or the new date would
+    sort before the last one.
+    """
+    with open(path, "rb") as f:
+        raw = f.read()
+    tail_start = max(0, len(raw) - 1024)
+    tail = raw[tail_start:]
+
+    start, end = tail.rfind(b"{"), tail.rfind(b"}")
+    if start == -1 or end < start or tail[end + 1:].strip() != b"]":
+        return False
+    try:
+        last_date = loads(tail[start:end + 1]).get("date")
+    except ValueError:
+        return False
+    if not isinstance(last_date, str) or last_date > record["date"]:
+        return False
+
+    body = dumps([record])
+    if last_date == record["date"]:
+        # Same day: replace the last record
+        blob = raw[:tail_start + start] + body[body.index(b"{"):]
+    else:
+        # New day: append after the last record
+        blob = raw[:tail_start + end + 1] + b"," + body[1:]
+    write_atomic(path, blob)
+    return True
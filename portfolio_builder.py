@@ -14,9 +14,13 @@
 from __future__ import annotations
 import os
 import json
+from operator import itemgetter
+import numpy as np
 import pandas as pd
 from datetime import datetime, timezone
 
+from json_io import dumps as _dumps, loads as _loads, write_if_changed as _write_if_changed, rewrite_nav_tail
+
 # ====== CONFIG ======
 OUTPUT_DIR = "public/data"
 SCAN_JSON = os.path.join(OUTPUT_DIR, "scan_3day.json")
@@ -28,40 +32,56 @@ PORTFOLIO_SUMMARY_JSON = os.path.join(OUTPUT_DIR, "portfolio_summary.json")
 START_NAV_NOK = 50_000.0
 FEE_BUY = 19.0
 FEE_SELL = 19.0
+FEE_ROUND_TRIP = FEE_BUY + FEE_SELL  # booked on each closed trade
 
 ALLOCATION_PCT = 0.25
 MAX_POSITIONS = int(1.0 / ALLOCATION_PCT)  # 4
 
+TRADE_LOG_COLS = ["Ticker","EntryDate","EntryPrice","ExitDate","ExitPrice","Qty",
+                  "StakeNOK","FeesNOK","PL_NOK","PL_PCT","Reason"]
+
+_UTC = timezone.utc
+
 # ====== IO HELPERS ======
 def _today_date(scan_rows) -> str:
     try:
-        dates = {r.get("Date") for r in scan_rows if r.get("Date")}
-        if len(dates) == 1:
-            d = list(dates)[0]
+        # Single shared date in the scan -> use it; stop at the first mismatch
+        d = next((r["Date"] for r in scan_rows if r.get("Date")), None)
+        if d and all(not r.get("Date") or r["Date"] == d for r in scan_rows):
             return pd.to_datetime(d).strftime("%Y-%m-%d")
     except Exception:
         pass
-    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    return datetime.now(_UTC).isoformat()[:10]
+
+_scan_cache = None  # (mtime_ns, size, rows) of the last parsed scan
 
 def load_scan():
-    if not os.path.exists(SCAN_JSON):
-        raise FileNotFoundError(f"Missing {SCAN_JSON}. Run the signal script first.")
-    with open(SCAN_JSON, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    rows = []
-    for r in data:
-        t = r.get("Ticker")
-        p = r.get("LastPrice")
-        s = r.get("Signal")
-        if not t or p is None or s is None:
-            continue
-        rows.append({
+    global _scan_cache
+    try:
+        st = os.stat(SCAN_JSON)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Missing {SCAN_JSON}. Run the signal script first.") from None
+    if _scan_cache is not None and _scan_cache[:2] == (st.st_mtime_ns, st.st_size):
+        return _scan_cache[2]
+    with open(SCAN_JSON, "rb") as f:
+        data = _loads(f.read())
+    get = dict.get
+    # The one-element inner loop binds t/p/s once per row
+    rows = [
+        {
             "Ticker": str(t),
             "Status": str(s).upper(),   # BUY / SELL / HOLD
             "LastPrice": float(p),
-            "Date": r.get("Date"),
-            "ExitReason": r.get("ExitReason")
-        })
+            "Date": get(r, "Date"),
+            "ExitReason": get(r, "ExitReason")
+        }
+        for r in data
+        for t, p, s in ((get(r, "Ticker"), get(r, "LastPrice"), get(r, "Signal")),)
+        if t and p is not None and s is not None
+    ]
+    # Ticker order here makes every candidate list downstream sorted too
+    rows.sort(key=itemgetter("Ticker"))
+    _scan_cache = (st.st_mtime_ns, st.st_size, rows)
     return rows
 
 def load_state():
@@ -77,8 +97,8 @@ def load_state():
         }
         save_state(state)
         return state
-    with open(STATE_JSON, "r", encoding="utf-8") as f:
-        state = json.load(f)
+    with open(STATE_JSON, "rb") as f:
+        state = _loads(f.read())
 
     # Backward-compatible defaults if older state exists
     state.setdefault("max_slots", MAX_POSITIONS)
@@ -94,17 +114,20 @@ def load_state():
 
 def save_state(state):
     os.makedirs(OUTPUT_DIR, exist_ok=True)
-    with open(STATE_JSON, "w", encoding="utf-8") as f:
-        json.dump(state, f, indent=2)
+    _write_if_changed(STATE_JSON, _dumps(state))
 
 def read_trade_log() -> pd.DataFrame:
     if os.path.exists(TRADE_LOG_CSV):
-        return pd.read_csv(TRADE_LOG_CSV, dtype={"Ticker": str})
-    cols = ["Ticker","EntryDate","EntryPrice","ExitDate","ExitPrice","Qty",
-            "StakeNOK","FeesNOK","PL_NOK","PL_PCT","Reason"]
-    return pd.DataFrame(columns=cols)
-
-def write_trade_log(df: pd.DataFrame):
+        # Dates are written by this module as YYYY-MM-DD; keep them as strings
+        return pd.read_csv(TRADE_LOG_CSV, dtype={"Ticker": str, "EntryDate": str, "ExitDate": str})
+    return pd.DataFrame(columns=TRADE_LOG_COLS)
+
+def write_trade_log(df: pd.DataFrame, keep_rows: int = 0):
+    """Write the trade log; the first keep_rows rows are already on disk unchanged."""
+    if keep_rows and os.path.exists(TRADE_LOG_CSV):
+        if keep_rows < len(df):
+            df.iloc[keep_rows:].to_csv(TRADE_LOG_CSV, mode="a", header=False, index=False)
+        return
     df.to_csv(TRADE_LOG_CSV, index=False)
 
 def read_portfolio_nav() -> pd.DataFrame:
@@ -117,17 +140,28 @@ def read_portfolio_nav() -> pd.DataFrame:
 
 def write_portfolio_nav(df: pd.DataFrame, start_nav: float):
     df = df.sort_values("date")
-    out = []
-    for _, row in df.iterrows():
-        nav = float(row["nav"])
-        pl_pct = (nav - start_nav) / start_nav if start_nav else 0.0
-        out.append({
-            "date": row["date"],
-            "nav": nav,
-            "pl_pct": pl_pct
-        })
-    with open(PORTFOLIO_NAV_JSON, "w", encoding="utf-8") as f:
-        json.dump(out, f, indent=2)
+    navs = df["nav"].to_numpy(dtype=np.float64)
+    pl_pcts = (navs - start_nav) / start_nav if start_nav else np.zeros_like(navs)
+    out = [
+        {"date": d, "nav": n, "pl_pct": p}
+        for d, n, p in zip(df["date"].tolist(), navs.tolist(), pl_pcts.tolist())
+    ]
+    _write_if_changed(PORTFOLIO_NAV_JSON, _dumps(out))
+
+def update_portfolio_nav(date: str, nav: float, start_nav: float):
+    """Record today's NAV, patching only the tail of portfolio_nav.json when possible."""
+    pl_pct = (nav - start_nav) / start_nav if start_nav else 0.0
+    record = {"date": date, "nav": float(nav), "pl_pct": pl_pct}
+    if os.path.exists(PORTFOLIO_NAV_JSON) and rewrite_nav_tail(PORTFOLIO_NAV_JSON, record):
+        return
+
+    nav_df = read_portfolio_nav()
+    if nav_df.empty:
+        nav_df = pd.DataFrame([{"date": date, "nav": nav}])
+    else:
+        nav_df = nav_df[nav_df["date"] != date]
+        nav_df = pd.concat([nav_df, pd.DataFrame([{"date": date, "nav": nav}])], ignore_index=True)
+    write_portfolio_nav(nav_df, start_nav)
 
 def write_portfolio_summary(date: str, nav: float, start_nav: float):
     os.makedirs(OUTPUT_DIR, exist_ok=True)
@@ -139,76 +173,104 @@ def write_portfolio_summary(date: str, nav: float, start_nav: float):
         "pl_nok": float(pl_nok),
         "pl_pct": float(pl_pct)
     }
-    with open(PORTFOLIO_SUMMARY_JSON, "w", encoding="utf-8") as f:
-        json.dump(payload, f, indent=2)
+    # Machine-read only: compact
+    _write_if_changed(PORTFOLIO_SUMMARY_JSON, _dumps(payload, indent=False))
 
 # ====== CORE ======
 def _compute_nav(state, by_ticker) -> float:
-    nav = float(state["cash"])
-    for ticker, pos in state["positions"].items():
-        px = by_ticker.get(ticker, {}).get("LastPrice", pos.get("entry_price", 0.0))
-        nav += float(pos["qty"]) * float(px)
-    return float(nav)
+    positions = state["positions"]
+    n = len(positions)
+    if not n:
+        return float(state["cash"])
+    # Quantities and marks as parallel arrays; unpriced tickers mark at entry
+    qtys = np.fromiter((p["qty"] for p in positions.values()), dtype=np.float64, count=n)
+    pxs = np.fromiter(
+        (by_ticker.get(t, {}).get("LastPrice", p.get("entry_price", 0.0)) for t, p in positions.items()),
+        dtype=np.float64, count=n,
+    )
+    return float(state["cash"]) + float(np.dot(qtys, pxs))
 
 def process_signals():
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
     scan = load_scan()
     state = load_state()
-    trade_log = read_trade_log()
 
     today = _today_date(scan)
+    # Index rows by ticker (the last row wins for a repeated ticker), then
+    # bucket SELL/BUY candidates in one pass over the index. Both come out
+    # sorted, as load_scan orders rows by ticker.
+    # A ticker has a single status, so selling first never frees a BUY slot
+    # for a ticker bucketed here.
     by_ticker = {r["Ticker"]: r for r in scan}
-
-    # 1) SELL
-    sell_candidates = [
-        t for t, r in by_ticker.items()
-        if r["Status"] == "SELL" and t in state["positions"]
-    ]
-    for ticker in sorted(sell_candidates):
-        pos = state["positions"][ticker]
-        last_price = by_ticker[ticker]["LastPrice"]
-        qty = float(pos["qty"])
-        proceeds = qty * last_price
-        state["cash"] += proceeds - FEE_SELL
-
-        stake = float(pos.get("stake_nok", proceeds))  # stake_nok should exist; fallback just in case
-        fees_total = FEE_BUY + FEE_SELL
-        pl_nok = (proceeds - stake) - fees_total
-        pl_pct = pl_nok / stake if stake != 0 else 0.0
-        reason = by_ticker[ticker].get("ExitReason") or "SELL"
-
-        new_row = pd.DataFrame([{
-            "Ticker": ticker,
-            "EntryDate": pos["entry_date"],
-            "EntryPrice": float(pos["entry_price"]),
-            "ExitDate": today,
-            "ExitPrice": float(last_price),
-            "Qty": qty,
-            "StakeNOK": stake,
-            "FeesNOK": fees_total,
-            "PL_NOK": pl_nok,
-            "PL_PCT": pl_pct,
-            "Reason": reason
-        }])
-        trade_log = pd.concat([trade_log, new_row], ignore_index=True)
-
-        del state["positions"][ticker]
-
-    if not trade_log.empty:
-        for c in ["EntryDate","ExitDate"]:
-            trade_log[c] = pd.to_datetime(trade_log[c]).dt.strftime("%Y-%m-%d")
-        trade_log = trade_log.drop_duplicates(subset=["Ticker","EntryDate","ExitDate"], keep="first")
-        trade_log = trade_log.sort_values(["Ticker","EntryDate","ExitDate"]).reset_index(drop=True)
+    sell_candidates, buy_candidates = [], []
+    held = state["positions"]
+    for t, r in by_ticker.items():
+        status = r["Status"]
+        if status == "SELL":
+            if t in held:
+                sell_candidates.append(t)
+        elif status == "BUY":
+            if t not in held:
+                buy_candidates.append(t)
+
+    # 1) SELL -- the trade log is only loaded when a row may be added
+    # (or the file has yet to be created)
+    trade_log = None
+    if sell_candidates or not os.path.exists(TRADE_LOG_CSV):
+        trade_log = read_trade_log()
+        n_logged = len(trade_log)
+
+    if sell_candidates:
+        sell_df = pd.DataFrame.from_records(
+            [
+                (
+                    t,
+                    held[t]["entry_date"],
+                    held[t]["entry_price"],
+                    by_ticker[t]["LastPrice"],
+                    held[t]["qty"],
+                    held[t].get("stake_nok"),
+                    by_ticker[t].get("ExitReason") or "SELL",
+                )
+                for t in sell_candidates
+            ],
+            columns=["Ticker","EntryDate","EntryPrice","ExitPrice","Qty","StakeNOK","Reason"],
+        ).astype({"EntryPrice": float, "ExitPrice": float, "Qty": float, "StakeNOK": float})
+
+        proceeds = sell_df["Qty"] * sell_df["ExitPrice"]
+        state["cash"] += float((proceeds - FEE_SELL).sum())
+
+        # stake_nok should exist; fall back to proceeds just in case
+        stake = sell_df["StakeNOK"].fillna(proceeds)
+        sell_df["StakeNOK"] = stake
+        sell_df["ExitDate"] = today
+        sell_df["FeesNOK"] = FEE_ROUND_TRIP
+        sell_df["PL_NOK"] = (proceeds - stake) - FEE_ROUND_TRIP
+        sell_df["PL_PCT"] = (sell_df["PL_NOK"] / stake).where(stake != 0, 0.0)
+
+        for t in sell_df["Ticker"]:
+            del held[t]
+
+        new_rows = sell_df[TRADE_LOG_COLS]
+        trade_log = new_rows if trade_log.empty else pd.concat([trade_log, new_rows], ignore_index=True)
+
+    if trade_log is not None:
+        if not trade_log.empty:
+            trade_log = trade_log.drop_duplicates(subset=["Ticker","EntryDate","ExitDate"], keep="first")
+            trade_log = trade_log.sort_values(["Ticker","EntryDate","ExitDate"])
+        # Old rows still first and in place: only the new ones need appending
+        head = trade_log.index[:n_logged]
+        keep_rows = n_logged if len(head) == n_logged and (head == np.arange(n_logged)).all() else 0
+        trade_log = trade_log.reset_index(drop=True)
 
     # 2) BUY (25% of NAV allocation concept)
     current_slots = len(state["positions"])
     free_slots = max(0, state["max_slots"] - current_slots)
-    buy_candidates = sorted([
-        t for t, r in by_ticker.items()
-        if r["Status"] == "BUY" and t not in state["positions"]
-    ])
-
+    # NAV using current holdings at today's prices; computed lazily, then
+    # carried forward (a BUY turns stake into an equal-value position, so
+    # NAV only drops by the fee)
+    nav_now = None
     for ticker in buy_candidates:
         if free_slots <= 0:
             break
@@ -221,8 +283,8 @@ def process_signals():
         if state["cash"] <= FEE_BUY:
             continue
 
-        # NAV is computed using current holdings at today's prices
-        nav_now = _compute_nav(state, by_ticker)
+        if nav_now is None:
+            nav_now = _compute_nav(state, by_ticker)
 
         target_invest = float(state["allocation_pct"]) * nav_now  # 25% of NAV
         investable_cash = float(state["cash"]) - FEE_BUY          # leave room for fee
@@ -236,6 +298,7 @@ def process_signals():
 
         # Book the buy: reduce cash by stake + fee
         state["cash"] -= (stake_nok + FEE_BUY)
+        nav_now -= FEE_BUY
 
         state["positions"][ticker] = {
             "qty": float(qty),
@@ -248,18 +311,11 @@ def process_signals():
     # 3) NAV
     nav = _compute_nav(state, by_ticker)
 
-    # 4) NAV log
-    nav_df = read_portfolio_nav()
-    if nav_df.empty:
-        nav_df = pd.DataFrame([{"date": today, "nav": nav}])
-    else:
-        nav_df = nav_df[nav_df["date"] != today]
-        nav_df = pd.concat([nav_df, pd.DataFrame([{"date": today, "nav": nav}])], ignore_index=True)
-
-    # 5) Save
+    # 4) Save (NAV log included)
     save_state(state)
-    write_trade_log(trade_log)
-    write_portfolio_nav(nav_df, start_nav=float(state["start_nav"]))
+    if trade_log is not None:
+        write_trade_log(trade_log, keep_rows)
+    update_portfolio_nav(today, nav, start_nav=float(state["start_nav"]))
     write_portfolio_summary(today, nav, float(state["start_nav"]))
 
     print(f"[{today}] NAV: {nav:,.2f} NOK | Cash: {state['cash']:,.2f} NOK | Positions: {len(state['positions'])}")
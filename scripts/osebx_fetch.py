@@ -1,11 +1,26 @@
 # scripts/osebx_fetch.py
 # Fetch 1y of daily OSEBX index data from Yahoo's public chart API
-# and write to public/data/osebx.json (date + close).
+# and write to public/data/osebx.json (parallel date + close arrays).
 
-import os, json, time
+import os, json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from urllib.request import Request, urlopen
-from urllib.error import URLError, HTTPError
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # parquet copy is optional; JSON is always written
+    pa = None
+
+try:
+    import orjson  # fast JSON; stdlib json is the fallback
+except ImportError:
+    orjson = None
 
 CANDIDATES = ["OSEBX.OL", "^OSEBX"]  # try both symbols
 RANGE = "1y"
@@ -23,23 +38,27 @@ def yahoo_chart_url(symbol: str) -> str:
         f"{symbol}?range={RANGE}&interval={INTERVAL}&includePrePost=false"
     )
 
+# One keep-alive session for every request; retries with backoff live in the adapter
+SESSION = requests.Session()
+SESSION.headers.update({"User-Agent": UA, "Accept": "application/json"})
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=4,
+    max_retries=Retry(total=4, backoff_factor=1.5, status_forcelist=[429, 500, 502, 503, 504]),
+))
+
 def http_get_json(url: str) -> dict:
-    # simple GET with headers + small retry loop
-    last_err = None
-    for attempt in range(4):
-        try:
-            req = Request(url, headers={"User-Agent": UA, "Accept": "application/json"})
-            with urlopen(req, timeout=20) as resp:
-                data = resp.read()
-            return json.loads(data.decode("utf-8"))
-        except (HTTPError, URLError, json.JSONDecodeError) as e:
-            last_err = e
-            # brief backoff
-            time.sleep(1.5 * (attempt + 1))
-    raise RuntimeError(f"GET failed for {url}: {last_err}")
+    try:
+        resp = SESSION.get(url, timeout=20)
+        resp.raise_for_status()
+        if orjson is not None:
+            return orjson.loads(resp.content)  # bytes in, no separate decode
+        return resp.json()
+    except (requests.RequestException, ValueError) as e:  # JSONDecodeError is a ValueError
+        raise RuntimeError(f"GET failed for {url}: {e}") from e
 
 def fetch_rows(symbol: str):
-    """Return list of {'t': 'YYYY-MM-DD', 'close': float}."""
+    """Return parallel lists (dates as 'YYYY-MM-DD', closes as float)."""
     url = yahoo_chart_url(symbol)
     raw = http_get_json(url)
 
@@ -57,48 +76,64 @@ def fetch_rows(symbol: str):
     quotes = ((r0.get("indicators") or {}).get("quote") or [{}])[0]
     closes = quotes.get("close") or []
 
-    rows = []
-    for t, c in zip(ts, closes):
-        if c is None:
-            continue
-        # timestamps are seconds since epoch (UTC)
-        d = datetime.fromtimestamp(t, tz=timezone.utc).strftime("%Y-%m-%d")
-        rows.append({"t": d, "close": float(c)})
+    # timestamps are seconds since epoch (UTC); format them all in one call
+    days = np.datetime_as_string(np.asarray(ts, dtype="datetime64[s]"), unit="D").tolist()
+    dates = [d for d, c in zip(days, closes) if c is not None]
+    values = [float(c) for c in closes[:len(days)] if c is not None]
 
-    if not rows:
+    if not dates:
         raise RuntimeError(f"No valid rows for {symbol}")
 
-    return rows
+    return dates, values
 
 def main():
     last_err = None
-    for sym in CANDIDATES:
-        try:
-            print(f"Attempting Yahoo chart API for {sym}")
-            rows = fetch_rows(sym)
-            source = sym
-            print(f"Fetched {len(rows)} rows from {sym}")
-            break
-        except Exception as e:
-            print(f"Failed for {sym}: {e}")
-            rows = None
-            last_err = e
+    rows = None
+    # Query all symbols at once; still prefer them in CANDIDATES order
+    with ThreadPoolExecutor(max_workers=len(CANDIDATES)) as ex:
+        futures = [(sym, ex.submit(fetch_rows, sym)) for sym in CANDIDATES]
+        for sym, fut in futures:
+            try:
+                print(f"Attempting Yahoo chart API for {sym}")
+                rows = fut.result()
+                source = sym
+                print(f"Fetched {len(rows[0])} rows from {sym}")
+                break
+            except Exception as e:
+                print(f"Failed for {sym}: {e}")
+                rows = None
+                last_err = e
 
     if rows is None:
         raise RuntimeError(f"Failed to fetch OSEBX data via Yahoo for {CANDIDATES}. Last error: {last_err}")
 
     out = {
         "ticker": source,
-        "as_of": datetime.utcnow().strftime("%Y-%m-%d %H:%M UTC"),
-        "rows": rows,
+        "as_of": datetime.now(timezone.utc).isoformat(sep=" ", timespec="minutes")[:16] + " UTC",
+        "dates": rows[0],    # columnar: dates[i] pairs with closes[i]
+        "closes": rows[1],
     }
 
     os.makedirs("public/data", exist_ok=True)
     out_path = "public/data/osebx.json"
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(out, f, ensure_ascii=False)
-
-    print(f"Wrote {out_path} with {len(rows)} points (source: {source})")
+    if orjson is not None:
+        with open(out_path, "wb") as f:
+            f.write(orjson.dumps(out))
+    else:
+        with open(out_path, "w", encoding="utf-8") as f:
+            json.dump(out, f, ensure_ascii=False)
+
+    print(f"Wrote {out_path} with {len(rows[0])} points (source: {source})")
+
+    # Columnar copy for Python consumers; the site keeps reading the JSON
+    if pa is not None:
+        pq_path = "public/data/osebx.parquet"
+        tbl = pa.table({
+            "date": pa.array(np.asarray(rows[0], dtype="datetime64[D]")),
+            "close": pa.array(rows[1], type=pa.float64()),
+        }).replace_schema_metadata({"ticker": source, "as_of": out["as_of"]})
+        pq.write_table(tbl, pq_path, compression="zstd")
+        print(f"Wrote {pq_path}")
 
 if __name__ == "__main__":
     main()
@@ -3,14 +3,21 @@
 # Eksport: Samme output som Kode 1 (Ticker, 3D_Return, Signal, LastPrice, Date)
 
 from __future__ import annotations
-from datetime import datetime
-from typing import Optional, List, Dict, Any
+from datetime import datetime, timezone
+from typing import Optional, List, Dict
 import os
 import json
+import time
+import hashlib
 import numpy as np
 import pandas as pd
 import yfinance as yf
 
+try:
+    import orjson  # fast JSON; pandas' to_json is the fallback
+except ImportError:
+    orjson = None
+
 # ===== PARAMETERS =====
 START_DATE = "2024-01-01"        # earliest date to fetch
 END_DATE: Optional[str] = None   # None = today
@@ -42,9 +49,41 @@ TICKERS = [
 OUTPUT_DIR = "public/data"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# ===== Price cache (not committed) =====
+PRICE_CACHE_DIR = ".cache/prices"
+PRICE_CACHE_TTL_OPEN = 10 * 60           # seconds; below the 15-min scan schedule
+PRICE_CACHE_TTL_CLOSED = 12 * 60 * 60    # outside 08–18 Oslo and at weekends
+
+# ---------- Price cache ----------
+def _price_cache_path(tickers: List[str], start: str, end: Optional[str], use_adjusted: bool) -> str:
+    key = json.dumps(sorted(tickers) + [start, end, "1d", int(use_adjusted)])
+    return os.path.join(PRICE_CACHE_DIR, hashlib.md5(key.encode()).hexdigest() + ".parquet")
+
+def _price_cache_ttl() -> int:
+    now = pd.Timestamp.now(tz="Europe/Oslo")
+    if now.dayofweek < 5 and 8 <= now.hour < 18:
+        return PRICE_CACHE_TTL_OPEN
+    return PRICE_CACHE_TTL_CLOSED
+
+def _price_cache_get(path: str) -> tuple[Optional[pd.DataFrame], bool]:
+    """(cached frame or None, still within TTL)."""
+    try:
+        fresh = time.time() - os.path.getmtime(path) <= _price_cache_ttl()
+        return pd.read_parquet(path), fresh
+    except Exception:
+        return None, False  # missing, unreadable or no parquet engine → download
+
+def _price_cache_put(path: str, px: pd.DataFrame) -> None:
+    try:
+        os.makedirs(PRICE_CACHE_DIR, exist_ok=True)
+        tmp = path + ".tmp"
+        px.to_parquet(tmp, compression="zstd")
+        os.replace(tmp, path)
+    except Exception as e:
+        print(f"Could not write price cache: {e}")
+
 # ---------- Data download (robust) ----------
-def load_prices(tickers: List[str], start: str, end: Optional[str], use_adjusted: bool) -> pd.DataFrame:
-    print("Fetching data from Yahoo Finance...")
+def _download_prices(tickers: List[str], start: str, end: Optional[str], use_adjusted: bool) -> pd.DataFrame:
     data = yf.download(
         tickers=tickers,
         start=start,
@@ -53,168 +92,243 @@ def load_prices(tickers: List[str], start: str, end: Optional[str], use_adjusted
         auto_adjust=False,
         group_by="column",      # stabiliserer kolonnerekkefølge
         interval="1d",
-        threads=True,
+        threads=True,           # one batched request, yfinance's thread pool per symbol
     )
+    if data.empty:
+        return pd.DataFrame(columns=tickers, dtype=np.float64)
     price_key = "Adj Close" if use_adjusted else "Close"
 
-    if isinstance(data.columns, pd.MultiIndex):
-        # Variant A: ('Close', 'DNB.OL', ...)
-        if price_key in data.columns.get_level_values(0):
-            px = data[price_key].copy()
+    # group_by="column" gives ('Close', 'DNB.OL', ...): select the price level directly
+    try:
+        px = data[price_key]
+    except KeyError:
         # Variant B: ('DNB.OL', 'Close', ...)
-        elif price_key in data.columns.get_level_values(1):
-            px = data.xs(price_key, axis=1, level=1).copy()
-        else:
-            raise KeyError(f"Could not find '{price_key}' in downloaded data.")
-    else:
+        if not (isinstance(data.columns, pd.MultiIndex) and price_key in data.columns.get_level_values(1)):
+            raise KeyError(f"Could not find '{price_key}' in downloaded data.") from None
+        px = data.xs(price_key, axis=1, level=1)
+    if isinstance(px, pd.Series):
         # Én ticker → enkel DataFrame
-        if price_key in data.columns:
-            px = data[[price_key]].copy()
-            px.columns = [tickers[0]]
-        else:
-            raise KeyError(f"Could not find '{price_key}' in downloaded data (single ticker).")
-
-    px = px.sort_index().dropna(how="all")
+        px = px.to_frame(tickers[0])
     return px
 
+def load_prices(tickers: List[str], start: str, end: Optional[str], use_adjusted: bool) -> pd.DataFrame:
+    cache_path = _price_cache_path(tickers, start, end, use_adjusted)
+    cached, fresh = _price_cache_get(cache_path)
+    if cached is not None and not set(tickers).issubset(cached.columns):
+        # Written before dead tickers were kept as empty columns: start over
+        cached = None
+
+    if cached is not None and fresh:
+        print(f"Using cached prices from {cache_path}")
+        return cached.dropna(how="all", axis=1)
+
+    if cached is not None and not cached.empty and not use_adjusted:
+        # Stale cache: fetch only from the last cached day on (it may have been
+        # intraday) and let the new rows win. Adjusted closes rewrite history,
+        # so those always take the full download below.
+        tail_start = cached.index[-1].strftime("%Y-%m-%d")
+        print(f"Fetching data from Yahoo Finance since {tail_start}...")
+        new = _download_prices(tickers, tail_start, end, use_adjusted)
+        px = pd.concat([cached, new])
+        px = px[~px.index.duplicated(keep="last")]
+        # A ticker with no cached history that has prices again (an earlier
+        # download failed for it) gets its full history; dead ones stay empty
+        empty = cached.columns[cached.isna().all()]
+        revived = [t for t in tickers if t in empty and t in new and new[t].notna().any()]
+        if revived:
+            print(f"Backfilling {', '.join(revived)}...")
+            px = px.combine_first(_download_prices(revived, start, end, use_adjusted))
+    else:
+        print("Fetching data from Yahoo Finance...")
+        px = _download_prices(tickers, start, end, use_adjusted)
+
+    # yf.download already returns ascending dates; only sort if it did not
+    if not px.index.is_monotonic_increasing:
+        px = px.sort_index()
+    # Drop empty dates and never-traded tickers once, here; the scan then
+    # works on column slices of this frame with no further dropna copies
+    px = px.dropna(how="all")
+    if not px.empty:  # never cache a failed download; the next run retries Yahoo
+        # Keep every requested ticker, dead ones as empty columns, so the
+        # cache still covers the ticker list and later runs refresh the tail
+        _price_cache_put(cache_path, px.reindex(columns=tickers))
+    return px.dropna(how="all", axis=1)
+
+# ---------- Output ----------
+def write_json_records(df: pd.DataFrame, path: str) -> None:
+    if orjson is None:
+        df.to_json(path, orient="records", indent=2)
+        return
+    with open(path, "wb") as f:
+        f.write(orjson.dumps(
+            df.to_dict(orient="records"),
+            option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY,
+        ))
+
+def write_csv_rows(df: pd.DataFrame, path: str) -> None:
+    # Plain join, no quoting: fund1.html splits lines on ',' and no value
+    # here (tickers, signals, numbers, dates) contains one. NaN → empty.
+    cols = list(df.columns)
+    lines = [",".join(cols)]
+    for row in zip(*(df[c].tolist() for c in cols)):
+        lines.append(",".join("" if v is None or v != v else str(v) for v in row))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
 # ---------- Trading logic ----------
-def _status_row(
-    ticker: str,
-    open_trade: Dict[str, Any] | None,
-    date,
-    status: str,
-    last_price: float,
-    entry_price: float | None = None,
-    exit_reason: str | None = None
-) -> Dict[str, Any]:
-    TARGET_P = TARGET_PCT
-    entry_p = entry_price if entry_price is not None else (open_trade["entry_price"] if open_trade else None)
-    entry_d = (open_trade["entry_date"] if open_trade else None)
-    target_p = (entry_p * (1 + TARGET_P)) if entry_p is not None else None
-    ret_since_entry = (last_price / entry_p - 1.0) if (entry_p is not None and last_price and entry_p) else None
-    return {
-        "Ticker": ticker,
-        "Date": pd.Timestamp(date).strftime("%Y-%m-%d"),
-        "TimeUTC": datetime.utcnow().strftime("%H:%M UTC"),
-        "Status": status,  # BUY / SELL / CAUTION / IN_POSITION / HOLD
-        "LastPrice": float(last_price) if pd.notna(last_price) else None,
-        "EntryDate": pd.Timestamp(entry_d).strftime("%Y-%m-%d") if entry_d is not None else None,
-        "EntryPrice": float(entry_p) if entry_p is not None else None,
-        "TargetPrice": float(target_p) if target_p is not None else None,
-        "ReturnSinceEntry": float(ret_since_entry) if ret_since_entry is not None else None,
-        "ExitReason": exit_reason,
-        "Note": "Caution!" if status == "CAUTION" else None,
-    }
-
-def find_trades_for_series(close: pd.Series) -> Dict[str, Any]:
-    s = close.dropna()
-    if s.empty:
-        return {"today_status": None}
-
-    today = s.index[-1]
-    rets_by_k = {k: s.pct_change(k) for k in LOOKBACK_SET}
-    dates = s.index.to_list()
-    open_trade: Dict[str, Any] | None = None
-    today_status = None
-
-    def is_band_day(idx: int) -> bool:
-        if idx <= 0:
-            return False
-        t = dates[idx]
-        for k in LOOKBACK_SET:
-            if idx - k < 0:
-                continue
-            r = rets_by_k[k].loc[t]
-            if pd.notna(r) and (BAND_LOW <= r <= BAND_HIGH):
-                return True
-        return False
-
-    i = 0
-    n = len(dates)
-    while i < n:
-        d = dates[i]
-        price = s.loc[d]
-
-        if open_trade is None:
-            if i - 1 >= 0 and is_band_day(i - 1) and price > s.loc[dates[i - 1]]:
-                open_trade = {
-                    "entry_date": d,
-                    "entry_price": float(price),
-                    "armed_break_even": False,
-                }
-                if d == today:
-                    today_status = _status_row(close.name, open_trade, d, "BUY", price)
-                i += 1
-                continue
-            if d == today and today_status is None:
-                today_status = _status_row(close.name, None, d, "HOLD", price)
-
-        else:
-            entry = open_trade["entry_price"]
-
-            if d > open_trade["entry_date"] and price > entry:
-                open_trade["armed_break_even"] = True
-
-            # 1) Target
-            if price >= entry * (1 + TARGET_PCT):
-                if d == today:
-                    today_status = _status_row(close.name, None, d, "SELL", price, entry_price=entry, exit_reason="TARGET")
-                open_trade = None
-                i += 1
-                continue
-
-            # 2) Break-even
-            if open_trade.get("armed_break_even", False) and price < entry:
-                if d == today:
-                    today_status = _status_row(close.name, None, d, "SELL", price, entry_price=entry, exit_reason="BREAKEVEN")
-                open_trade = None
-                i += 1
-                continue
-
-            # 3) Caution/in position
-            if i - 1 >= 0 and price < s.loc[dates[i - 1]]:
-                if d == today:
-                    today_status = _status_row(close.name, open_trade, d, "CAUTION", price)
-            else:
-                if d == today:
-                    today_status = _status_row(close.name, open_trade, d, "IN_POSITION", price)
-
-        i += 1
-
-    if today_status is None:
-        if open_trade is not None:
-            today_status = _status_row(close.name, open_trade, today, "IN_POSITION", s.loc[today])
-        else:
-            today_status = _status_row(close.name, None, today, "HOLD", s.loc[today])
-
-    return {"today_status": today_status}
-
-def build_snapshot(price_df: pd.DataFrame) -> pd.DataFrame:
-    rows = []
-    for ticker in price_df.columns:
-        series = price_df[ticker].dropna()
-        res = find_trades_for_series(series)
-        rows.append(res["today_status"])
-    snapshot_df = pd.DataFrame(rows).sort_values(["Status", "Ticker"])
+SNAPSHOT_COLS = ["Ticker", "Date", "TimeUTC", "Status", "LastPrice", "EntryDate", "EntryPrice",
+                 "TargetPrice", "ReturnSinceEntry", "ExitReason", "Note"]
+# Ordered categorical: the snapshot sorts on int8 codes in business order
+STATUS_DTYPE = pd.CategoricalDtype(["BUY", "SELL", "CAUTION", "IN_POSITION", "HOLD"], ordered=True)
+
+def _utc_stamp() -> str:
+    return datetime.now(timezone.utc).strftime("%H:%M UTC")
+
+def _band_mask(rets: np.ndarray) -> np.ndarray:
+    # Band day: any lookback return (stacked on axis 0) within [BAND_LOW, BAND_HIGH]
+    return ((rets >= BAND_LOW) & (rets <= BAND_HIGH)).any(axis=0)
+
+def _series_band(px: np.ndarray) -> np.ndarray:
+    # Band mask of one gap-free price array; same arithmetic as pct_change(k)
+    rets = np.full((len(LOOKBACK_SET), len(px)), np.nan)
+    for r, k in zip(rets, LOOKBACK_SET):
+        r[k:] = px[k:] / px[:-k] - 1.0
+    return _band_mask(rets)
+
+def _today_status(px: np.ndarray, band: np.ndarray) -> tuple[str, int, float, str | None]:
+    """(status, entry index or -1, entry price or NaN, exit reason) on the last bar of `px`.
+
+    The entry index is set while a trade is open (BUY/CAUTION/IN_POSITION);
+    a SELL today reports the closed trade's entry price only.
+    """
+    # Positional arrays: everything below indexes by integer, not by date label
+    n = len(px)
+    last = n - 1
+
+    # Entry trigger for every bar at once: day i-1 is a band day (any
+    # lookback return within the band) and day i closes above day i-1
+    entry_ok = np.zeros(n, dtype=bool)
+    entry_ok[1:] = band[:-1] & (px[1:] > px[:-1])
+    entries = np.flatnonzero(entry_ok)
+
+    # Walk trade by trade: find the next entry, then its first exit
+    i = 0  # first bar at which we are flat
+    while True:
+        k = np.searchsorted(entries, i)
+        if k == len(entries):
+            return "HOLD", -1, np.nan, None
+        e = int(entries[k])
+        entry = float(px[e])
+        if e == last:
+            return "BUY", e, entry, None
+
+        after = px[e + 1:]
+        # 1) Target: first close at or above entry * (1 + TARGET_PCT)
+        hits = np.flatnonzero(after >= entry * (1 + TARGET_PCT))
+        exit_j, reason = (int(hits[0]), "TARGET") if len(hits) else (None, None)
+        # 2) Break-even: armed by a close above entry, then a later close below it
+        above = np.flatnonzero(after > entry)
+        if len(above):
+            below = np.flatnonzero(after[above[0] + 1:] < entry)
+            if len(below):
+                be_j = int(above[0] + 1 + below[0])
+                if exit_j is None or be_j < exit_j:
+                    exit_j, reason = be_j, "BREAKEVEN"
+
+        if exit_j is None:
+            # 3) Still open on the last bar: caution/in position
+            status = "CAUTION" if px[last] < px[last - 1] else "IN_POSITION"
+            return status, e, entry, None
+        x = e + 1 + exit_j
+        if x == last:
+            return "SELL", -1, entry, reason
+        i = x + 1
+
+def lookback_returns(price_df: pd.DataFrame) -> Dict[int, np.ndarray]:
+    """k-day returns (dates × tickers arrays) for every lookback used by the model or the export.
+
+    Same values as pct_change(k, fill_method=None): NaN for the first k rows
+    and wherever either price is missing.
+    """
+    px = price_df.to_numpy(dtype=np.float64)
+    out = {}
+    for k in sorted(set(LOOKBACK_SET) | {LOOKBACK_DAYS_EXPORT}):
+        r = np.full_like(px, np.nan)
+        np.divide(px[k:], px[:-k], out=r[k:])
+        r[k:] -= 1.0
+        out[k] = r
+    return out
+
+def build_snapshot(
+    price_df: pd.DataFrame,
+    rets_by_k: Dict[int, np.ndarray] | None = None,
+    time_utc: str | None = None,
+) -> pd.DataFrame:
+    if rets_by_k is None:
+        rets_by_k = lookback_returns(price_df)
+    # One dates × tickers price matrix and band mask for the whole frame;
+    # each ticker then works on its column slices
+    px_all = price_df.to_numpy(dtype=np.float64)
+    band_all = _band_mask(np.stack([rets_by_k[k] for k in LOOKBACK_SET]))
+    valid_all = ~np.isnan(px_all)
+    dates_all = price_df.index
+
+    tickers, status, last_pos, entry_pos, entry_px, reasons = [], [], [], [], [], []
+    for j, ticker in enumerate(price_df.columns):
+        pos = np.flatnonzero(valid_all[:, j])
+        if not len(pos):
+            continue
+        px = px_all[pos, j]
+        # Frame returns match the per-series ones only without interior gaps
+        band = band_all[pos, j] if pos[-1] - pos[0] + 1 == len(pos) else _series_band(px)
+        st, e, ep, why = _today_status(px, band)
+        tickers.append(ticker)
+        status.append(st)
+        last_pos.append(pos[-1])
+        entry_pos.append(pos[e] if e >= 0 else -1)
+        entry_px.append(ep)
+        reasons.append(why)
+
+    # Assemble every column at once from the per-ticker fields
+    col_idx = price_df.columns.get_indexer(tickers)
+    last_pos = np.asarray(last_pos, dtype=np.intp)
+    entry_pos = np.asarray(entry_pos, dtype=np.intp)
+    entry_px = np.asarray(entry_px, dtype=np.float64)
+    status = np.asarray(status, dtype=object)
+    date_strs = np.asarray(dates_all.strftime("%Y-%m-%d"), dtype=object)
+    last_px = px_all[last_pos, col_idx]
+
+    ret_since_entry = np.full(len(tickers), np.nan)
+    np.divide(last_px, entry_px, out=ret_since_entry, where=(entry_px != 0) & (last_px != 0))
+    ret_since_entry -= 1.0
+
+    snapshot_df = pd.DataFrame({
+        "Ticker": tickers,
+        "Date": date_strs[last_pos],
+        "TimeUTC": time_utc or _utc_stamp(),  # one run stamp for every row
+        "Status": pd.Categorical(status, dtype=STATUS_DTYPE),  # BUY / SELL / CAUTION / IN_POSITION / HOLD
+        "LastPrice": last_px,
+        "EntryDate": np.where(entry_pos >= 0, date_strs[np.maximum(entry_pos, 0)], None),
+        "EntryPrice": entry_px,
+        "TargetPrice": entry_px * (1 + TARGET_PCT),
+        "ReturnSinceEntry": ret_since_entry,
+        "ExitReason": reasons,
+        "Note": np.where(status == "CAUTION", "Caution!", None),
+    }, columns=SNAPSHOT_COLS).sort_values(["Status", "Ticker"])
     return snapshot_df
 
 # Kode 1 forventer Signal som BUY/HOLD; mapp fra Status
-def status_to_signal(status: str) -> str:
-    if status == "BUY":
-        return "BUY"
-    if status == "SELL":
-        return "SELL"
-    return "HOLD"
+SIGNAL_MAP = {"BUY": "BUY", "SELL": "SELL", "CAUTION": "HOLD", "IN_POSITION": "HOLD", "HOLD": "HOLD"}
 
 # ---------- Main ----------
 def main():
     # ---- Load price data ----
     price_data = load_prices(TICKERS, START_DATE, END_DATE, USE_ADJUSTED)
-    price_data = price_data.dropna(how="all", axis=1)
     if price_data.empty:
         raise RuntimeError("No price data downloaded.")
 
-    snapshot_df = build_snapshot(price_data)
+    rets_by_k = lookback_returns(price_data)
+    snapshot_df = build_snapshot(price_data, rets_by_k, _utc_stamp())
 
     # ---- Load REAL portfolio state ----
     portfolio_path = os.path.join(OUTPUT_DIR, "portfolio_state.json")
@@ -228,8 +342,7 @@ def main():
         cash = 0.0
 
     # ---- Compute 3-day return ----
-    three_day_rets = price_data.pct_change(LOOKBACK_DAYS_EXPORT).iloc[-1]
-    three_day_rets.name = "3D_Return"
+    three_day_rets = pd.Series(rets_by_k[LOOKBACK_DAYS_EXPORT][-1], index=price_data.columns, name="3D_Return")
 
     # ---- Merge model results and returns ----
     out = snapshot_df.merge(
@@ -242,74 +355,63 @@ def main():
     # ---- Compute NAV and investable amount (portfolio concept) ----
     # NAV = cash + sum(shares * last_price) across current holdings.
     # invest_amount = min(cash, 0.25 * NAV)
-    last_price_map = dict(zip(out["Ticker"], out["LastPrice"]))
-
-    nav = cash
-    for tkr, pos in real_positions.items():
-        try:
-            shares = float(pos.get("shares", 0.0))
-            px = float(last_price_map.get(tkr, np.nan))
-            if shares > 0 and pd.notna(px):
-                nav += shares * px
-        except Exception:
-            pass
+    # Unparseable share counts and missing prices contribute nothing.
+    shares = pd.to_numeric(
+        pd.Series({tkr: pos.get("shares", 0.0) for tkr, pos in real_positions.items()}, dtype=object),
+        errors="coerce",
+    )
+    held_px = out.set_index("Ticker")["LastPrice"].reindex(shares.index)
+    nav = cash + float((shares.where(shares > 0) * held_px).sum())
 
     target_invest = nav * ALLOCATION_PCT
     invest_amount = min(cash, target_invest)
 
     # ---- Override signals using REAL portfolio P&L + capacity ----
-    for idx, row in out.iterrows():
-        ticker = row["Ticker"]
-        last_price = row["LastPrice"]
-
-        # If ticker is in portfolio → apply HOLD/SELL rules
-        if ticker in real_positions:
-            entry_price = float(real_positions[ticker]["entry_price"])
-            real_pl_pct = (last_price / entry_price - 1.0) if entry_price > 0 else 0.0
-
-            # Real SELL rule (aligned with updated target)
-            if real_pl_pct >= TARGET_PCT:
-                out.at[idx, "Status"] = "SELL"
-            else:
-                out.at[idx, "Status"] = "HOLD"
-
-        # If not in portfolio:
-        else:
-            # Keep BUY only if:
-            #  - model says BUY
-            #  - portfolio has capacity (< 4 positions)
-            #  - investable cash per rule (min(cash, 0.25*NAV)) is > 0
-            if row["Status"] == "BUY":
-                if len(real_positions) >= MAX_POSITIONS_ALLOWED:
-                    out.at[idx, "Status"] = "HOLD"
-                elif invest_amount <= 0:
-                    out.at[idx, "Status"] = "HOLD"
-                else:
-                    continue  # allowed BUY
-            else:
-                out.at[idx, "Status"] = "HOLD"
+    # Held tickers: SELL once the real P&L reaches the target, else HOLD.
+    # Others keep BUY only if the model says BUY, the portfolio has
+    # capacity (< 4 positions) and investable cash (min(cash, 0.25*NAV)) > 0.
+    entry_map = {tkr: float(pos["entry_price"]) for tkr, pos in real_positions.items()}
+    held = out["Ticker"].isin(entry_map).to_numpy()
+    entry_px = out["Ticker"].map(entry_map).to_numpy(dtype=np.float64)
+    last_px = out["LastPrice"].to_numpy(dtype=np.float64)
+    # P&L 0 where there is no positive entry price (also the not-held rows)
+    real_pl_pct = np.divide(last_px, entry_px, out=np.ones_like(last_px), where=entry_px > 0) - 1.0
+
+    can_buy = len(real_positions) < MAX_POSITIONS_ALLOWED and invest_amount > 0
+    out["Status"] = np.where(
+        held,
+        np.where(real_pl_pct >= TARGET_PCT, "SELL", "HOLD"),
+        np.where((out["Status"] == "BUY").to_numpy() & can_buy, "BUY", "HOLD"),
+    )
 
     # ---- Convert Status → Signal ----
-    out["Signal"] = out["Status"].map(status_to_signal)
+    out["Signal"] = out["Status"].map(SIGNAL_MAP).fillna("HOLD")
 
     # ---- Build Kode 1 date string ----
-    out["Date"] = out["Date"].astype(str) + " " + out["TimeUTC"].astype(str)
+    out["Date"] = out["Date"] + " " + out["TimeUTC"]
 
     # ---- Final formatting ----
     out["LastPrice"] = out["LastPrice"].round(6)
     out = out[["Ticker", "3D_Return", "Signal", "LastPrice", "Date"]].copy()
-    out = out.sort_values("3D_Return")
+    out = out.sort_values("3D_Return", kind="stable")  # ties keep the snapshot order
 
-    # ---- Save JSON + CSV ----
+    # ---- Save JSON + CSV (+ parquet for Python consumers) ----
     csv_path = os.path.join(OUTPUT_DIR, "scan_3day.csv")
     json_path = os.path.join(OUTPUT_DIR, "scan_3day.json")
+    parquet_path = os.path.join(OUTPUT_DIR, "scan_3day.parquet")
 
-    out.to_csv(csv_path, index=False)
-    out.to_json(json_path, orient="records", indent=2)
+    write_csv_rows(out, csv_path)
+    write_json_records(out, json_path)
+    saved = [csv_path, json_path]
+    try:
+        out.to_parquet(parquet_path, compression="zstd", index=False)
+        saved.append(parquet_path)
+    except ImportError as e:  # no parquet engine; CSV/JSON are the published outputs
+        print(f"Skipping {parquet_path}: {e}")
 
     print("\n=== Export with REAL portfolio signals ===")
     print(out.head().to_string(index=False))
-    print(f"Saved to:\n - {csv_path}\n - {json_path}")
+    print("Saved to:\n" + "\n".join(f" - {p}" for p in saved))
 
 if __name__ == "__main__":
     main()